@@ -5,18 +5,26 @@
 # Shiny App created for use in Shinylive:
 # https://shinylive.io/py/examples/#plotly
 
-# To use, paste packages in requirements.txt and code from this app.py into the matching tabs in the link above, and then run the code.
+# To use, paste packages in requirements.txt and code from this app.py into the matching tabs in the link above,
+# add a histograms.py tab with the code from histograms.py, and then run the code.
 # Please send any issues or recommendations you find to gabrieljrich@pm.me
 
 
 import plotly.express as px
+import plotly.graph_objects as go
 from shiny.express import input, ui, output, render
 from shinywidgets import render_plotly, render_widget
-from shiny import reactive
+from shiny import reactive, req
 import palmerpenguins  # This package provides the Palmer Penguins dataset
-import seaborn as sns
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 import pandas as pd
+import numpy as np
+from histograms import bin_counts  # histogram binning helpers (histograms.py, next to this file)
+import functools
+import os
+import pathlib
+from typing import NamedTuple
 
 
 # Use the built-in function to load the Palmer Penguins dataset
@@ -30,7 +38,67 @@ import pandas as pd
 # - sex: male or female
 
 # it is then loaded into a pandas dataframe
-penguin_df = palmerpenguins.load_penguins()
+# The columns are converted to Arrow-backed dtypes, and the tables get a trimmed view of the dataframe
+# The converted dataframe is also saved as a Parquet file in this app's cache directory, so later loads
+# skip parsing the CSV (bump the version in the file name if the conversion changes)
+PENGUIN_COLUMNS = ["species", "island", "bill_length_mm", "bill_depth_mm", "flipper_length_mm", "body_mass_g", "sex", "year"]
+PENGUIN_PARQUET = pathlib.Path.home() / ".cache" / "cintel-03-reactive" / "palmerpenguins-v1.parquet"
+
+def load_penguin_df() -> pd.DataFrame:
+    try:
+        df = pd.read_parquet(PENGUIN_PARQUET, dtype_backend="pyarrow")
+        if list(df.columns) == PENGUIN_COLUMNS:
+            return df
+    except (OSError, ValueError):
+        pass  # no cache yet, or an unreadable one: rebuild it from the CSV below
+    df = palmerpenguins.load_penguins().convert_dtypes(dtype_backend="pyarrow")
+    # Write to a temporary name first so another worker never reads a half-written file
+    tmp = PENGUIN_PARQUET.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        PENGUIN_PARQUET.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(tmp)
+        tmp.replace(PENGUIN_PARQUET)
+    except OSError:
+        tmp.unlink(missing_ok=True)  # cache not writable: just load from the CSV again next time
+    return df
+
+penguin_df = load_penguin_df()
+
+# Store species as a categorical, so membership checks compare small integer codes instead of strings
+penguin_df["species"] = penguin_df["species"].astype("category")
+
+# The tables only show the columns used elsewhere in the app (year is left out)
+SHOW_COLS = [c for c in PENGUIN_COLUMNS if c != "year"]
+penguin_df_view = penguin_df[SHOW_COLS]
+
+# Keep each numeric column as its own float32 NumPy array (NaN for missing values),
+# plus a copy with the NaNs already removed for the histograms
+NUMERIC_ATTRS = ["bill_length_mm", "bill_depth_mm", "flipper_length_mm", "body_mass_g"]
+NUMERIC_COLS = {c: penguin_df[c].to_numpy(dtype=np.float32, na_value=np.nan) for c in NUMERIC_ATTRS}
+CLEAN = {c: v[~np.isnan(v)] for c, v in NUMERIC_COLS.items()}
+
+# The text columns used by the filters, as NumPy string arrays ("" for missing values)
+LABEL_COLS = {c: penguin_df[c].to_numpy(dtype=str, na_value="") for c in ["species", "island", "sex"]}
+
+# Scatterplot labels and category orders don't change, so they're built once here
+SCATTER_LABELS = {
+    "bill_depth_mm": "Bill Depth (mm)",
+    "bill_length_mm": "Bill Length (mm)",
+    "species": "Species of Penguin",
+    "island": "Island of origin",
+}
+ISLAND_ORDER = sorted(penguin_df["island"].dropna().unique().tolist())
+SPECIES_ORDER = ["Adelie", "Chinstrap", "Gentoo"]
+
+# Integer code of every row's species, and the code for each species name
+SPECIES_CODES = penguin_df["species"].cat.codes.to_numpy()
+SPECIES_CODE = {s: i for i, s in enumerate(penguin_df["species"].cat.categories)}
+
+
+def _species_mask(selected) -> np.ndarray:
+    """Boolean row mask for the selected species, using a lookup table over the species codes."""
+    want = np.fromiter((SPECIES_CODE[s] for s in selected), dtype=SPECIES_CODES.dtype)
+    return np.isin(SPECIES_CODES, want, kind="table")
 
 
 with ui.layout_columns():
@@ -39,14 +107,44 @@ with ui.layout_columns():
         "Penguin Data Table"
         @render.data_frame
         def penguintable():
-            return render.DataTable(penguin_df, filters=False)
+            return render.DataTable(penguin_df_view, filters=False)
 
     # Data Grid
     with ui.card():
         "Penguin Data Grid"
         @render.data_frame
         def penguingrid():
-            return render.DataGrid(penguin_df, filters=False)
+            return render.DataGrid(penguin_df_view, filters=False)
+
+
+def reset_axes(ax):
+    """Clear a reused Axes and put its Figure back to the default DPI and size.
+
+    render.plot scales the figure's DPI by the screen's pixel ratio on every render,
+    so without this a shared Figure keeps growing its DPI and shrinking its size.
+    """
+    fig = ax.get_figure()
+    fig.set_dpi(matplotlib.rcParams["figure.dpi"])
+    fig.set_size_inches(matplotlib.rcParams["figure.figsize"])
+    ax.clear()
+    return ax
+
+
+# Shiny Express runs this file once per session, so each session gets its own cache
+@functools.lru_cache(maxsize=64)
+def attr_hist_bins(attr: str, nb: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return (counts, edges) for an attribute over the full dataset, cached for recently used (attr, nb) pairs."""
+    counts, edges = bin_counts(CLEAN[attr], nb)
+    # The arrays are shared by every caller, so make them read-only
+    counts.flags.writeable = False
+    edges.flags.writeable = False
+    return counts, edges
+
+
+def draw_hist(ax, counts: np.ndarray, edges: np.ndarray):
+    """Draw precomputed histogram bins as matplotlib bars, styled like sns.histplot."""
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", color="C0", alpha=0.75, edgecolor="black", linewidth=0.5)
+    return ax
 
 
 # Add a Shiny UI sidebar for user interaction
@@ -67,7 +165,7 @@ with ui.sidebar(open="open"):
     #   a list of options for the input (in square brackets) 
     #   e.g. ["bill_length_mm", "bill_depth_mm", "flipper_length_mm", "body_mass_g"]
     ui.input_selectize(
-        "selected_attribute", "Select Attribute", ["bill_length_mm", "bill_depth_mm", "flipper_length_mm", "body_mass_g"]
+        "selected_attribute", "Select Attribute", NUMERIC_ATTRS
     )
 
     # Use ui.input_numeric() to create a numeric input for the number of Plotly histogram bins
@@ -95,11 +193,11 @@ with ui.sidebar(open="open"):
     #   a list of options for the input (in square brackets) as ["Adelie", "Gentoo", "Chinstrap"]
     #   a keyword argument selected= a list of selected options for the input (in square brackets)
     #   a keyword argument inline= a Boolean value (True or False) as you like
-    ui.input_checkbox_group("selected_species_list", label="Filter Species", choices=["Adelie", "Chinstrap","Gentoo"], selected=["Adelie"],inline=False)
+    ui.input_checkbox_group("selected_species_list", label="Filter Species", choices=SPECIES_ORDER, selected=["Adelie"],inline=False)
 
-    ui.input_checkbox_group("selected_island_list", label="Filter Island", choices=["Biscoe", "Dream","Torgersen"], selected=["Biscoe"],inline=False)
+    ui.input_checkbox_group("selected_island_list", label="Filter Island", choices=ISLAND_ORDER, selected=["Biscoe"],inline=False)
 
-    ui.input_checkbox_group("selected_sex_list", label="Filter Sex", choices=["Male", "Female"], selected=["Male", "Female"],inline=False)
+    ui.input_checkbox_group("selected_sex_list", label="Filter Sex", choices={"male": "Male", "female": "Female"}, selected=["male", "female"],inline=False)
 
     ui.input_slider("mass_min_max_range", "Filter by Mass (g)", min=2500, max=6500, value=[2500,6000])
 
@@ -113,29 +211,101 @@ with ui.sidebar(open="open"):
     #   a keyword argument target= "_blank" to open the link in a new tab
     ui.a("gjrich - github", href="https://github.com/gjrich/cintel-03-reactive/")
 
+# The filtered rows, one NumPy array per column the plots use
+class FilteredArrays(NamedTuple):
+    species: np.ndarray
+    island: np.ndarray
+    bill_length_mm: np.ndarray
+    bill_depth_mm: np.ndarray
+    body_mass_g: np.ndarray
+
+
+# Returned as-is when no species is selected
+EMPTY_FILTERED = FilteredArrays(
+    species=LABEL_COLS["species"][:0],
+    island=LABEL_COLS["island"][:0],
+    bill_length_mm=NUMERIC_COLS["bill_length_mm"][:0],
+    bill_depth_mm=NUMERIC_COLS["bill_depth_mm"][:0],
+    body_mass_g=NUMERIC_COLS["body_mass_g"][:0],
+)
+
+
 # Filter the dataset 
-@reactive_calc
-def filtered_data() -> pd.DataFrame:
+@reactive.calc
+def filtered_data() -> FilteredArrays:
     
     # Filter penguin_df based on selected species & island
     selected_species = input.selected_species_list()  # Get the selected species from the checkbox group
-    filtered_df = penguin_df[penguin_df["species"].isin(selected_species)]
+    if not selected_species:
+        return EMPTY_FILTERED
+    idx = np.flatnonzero(_species_mask(selected_species))
     selected_island = input.selected_island_list() # get selected island from checkbox group
-    filtered_df = filtered_df[filtered_df["island"].isin(selected_island)]
+    idx = idx[np.isin(LABEL_COLS["island"][idx], np.array(selected_island, dtype=str))]
 
     # Filter based on sex
     selected_sex = input.selected_sex_list()
-    filtered_df = filtered_df[filtered_df["sex"].isin(selected_sex)]
+    idx = idx[np.isin(LABEL_COLS["sex"][idx], np.array(selected_sex, dtype=str))]
 
-    # Filter based on body mass
+    # Filter based on body mass (missing masses are dropped, since NaN fails both comparisons)
     selected_min_mass, selected_max_mass = input.mass_min_max_range()
-    filtered_df = filtered_df[(filtered_df["body_mass_g"] <= selected_max_mass) & (filtered_df["body_mass_g"] >= selected_min_mass)]
-    
-    if filtered_df.empty:
-        return pd.DataFrame()
-    
-    return filtered_df
+    mass = NUMERIC_COLS["body_mass_g"][idx]
+    idx = idx[(mass <= selected_max_mass) & (mass >= selected_min_mass)]
+
+    return FilteredArrays(
+        species=LABEL_COLS["species"][idx],
+        island=LABEL_COLS["island"][idx],
+        bill_length_mm=NUMERIC_COLS["bill_length_mm"][idx],
+        bill_depth_mm=NUMERIC_COLS["bill_depth_mm"][idx],
+        body_mass_g=NUMERIC_COLS["body_mass_g"][idx],
+    )
+
 
+# Static Plotly layouts, validated once here instead of through update_layout calls
+HIST_LAYOUT = go.Layout(title={"text": "Penguins", "x": 0.5}, yaxis_title="count", bargap=0)
+SCATTER_LAYOUT = go.Layout(
+    xaxis_title=SCATTER_LABELS["bill_length_mm"],
+    yaxis_title=SCATTER_LABELS["bill_depth_mm"],
+    legend_title_text=f"{SCATTER_LABELS['island']}, {SCATTER_LABELS['species']}",
+    uirevision="scatter_keep",  # keep the user's zoom/pan when the filtered points change
+)
+
+# The Plotly histogram is created once and updated in place, so the browser
+# only redraws the bars that changed instead of rebuilding the whole plot
+HIST_FIG = go.FigureWidget(data=[go.Bar(x=[], y=[], offset=0)], layout=HIST_LAYOUT)
+
+# Shown on the scatterplot instead of any points when no species is selected
+NO_SPECIES_NOTE = go.layout.Annotation(text="Select a species", xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False)
+
+# The scatterplot gets one WebGL trace per (island, species) pair, colored by island and marked by species,
+# in the same order plotly express would use. Filtering only swaps trace data and visibility.
+ISLAND_COLORS = dict(zip(ISLAND_ORDER, px.colors.qualitative.Plotly))
+SPECIES_SYMBOLS = dict(zip(SPECIES_ORDER, ["circle", "diamond", "square"]))
+_present = set(penguin_df.groupby(["island", "species"], observed=True).groups)
+SCATTER_KEYS = [(isl, sp) for isl in ISLAND_ORDER for sp in SPECIES_ORDER if (isl, sp) in _present]
+SCATTER_FIG = go.FigureWidget(
+    data=[
+        go.Scattergl(
+            x=[],
+            y=[],
+            mode="markers",
+            name=f"{isl}, {sp}",
+            marker={"color": ISLAND_COLORS[isl], "symbol": SPECIES_SYMBOLS[sp]},
+            hovertemplate=(
+                f"{SCATTER_LABELS['island']}={isl}<br>{SCATTER_LABELS['species']}={sp}<br>"
+                f"{SCATTER_LABELS['bill_length_mm']}=%{{x}}<br>{SCATTER_LABELS['bill_depth_mm']}=%{{y}}<extra></extra>"
+            ),
+            visible=False,
+        )
+        for isl, sp in SCATTER_KEYS
+    ],
+    layout=SCATTER_LAYOUT,
+)
+
+# Each matplotlib histogram draws on its own Figure/Axes, created once and reset before every redraw
+_FIG_HIST = Figure()
+_AX_HIST = _FIG_HIST.subplots()
+_FIG_RCALC = Figure()
+_AX_RCALC = _FIG_RCALC.subplots()
 
 
 # Build the UI
@@ -146,12 +316,23 @@ with ui.layout_columns():
         ui.card_header("Plotly Histogram")
         @render_widget
         def plot1():
-            scattery = px.histogram(
-                data_frame=penguin_df,
-                x=input.selected_attribute(),
-                nbins=input.plotly_bin_count()
-            ).update_layout(title={"text": "Penguins", "x": 0.5}, yaxis_title="count",xaxis_title=input.selected_attribute())
-            return scattery
+            return HIST_FIG
+
+        @reactive.effect
+        def update_plot1():
+            # A cleared or out-of-range numeric box would otherwise raise here and close the session:
+            # wait quietly for a usable value, and cap it at the input's max
+            nb = input.plotly_bin_count()
+            req(isinstance(nb, (int, float)) and nb >= 1)
+            nb = min(int(nb), 50)
+
+            # Bin the values and push only the new bars and axis title to the widget
+            counts, edges = attr_hist_bins(input.selected_attribute(), nb)
+            with HIST_FIG.batch_update():
+                HIST_FIG.data[0].x = edges[:-1]
+                HIST_FIG.data[0].y = counts
+                HIST_FIG.data[0].width = np.diff(edges)
+                HIST_FIG.layout.xaxis.title.text = input.selected_attribute()
 
 
     
@@ -159,7 +340,9 @@ with ui.layout_columns():
         ui.card_header("Seaborn Histogram")
         @render.plot
         def plot2():
-            ax=sns.histplot(data=filtered_df, x=input.selected_attribute(), bins=input.seaborn_bin_count())
+            counts, edges = attr_hist_bins(input.selected_attribute(), int(input.seaborn_bin_count()))
+            ax = reset_axes(_AX_HIST)
+            draw_hist(ax, counts, edges)
             ax.set_title("Penguins")
             ax.set_xlabel(input.selected_attribute())
             ax.set_ylabel("Count")
@@ -169,18 +352,30 @@ with ui.layout_columns():
         ui.card_header("Plotly Scatterplot: Species")
         @render_plotly
         def plotly_scatterplot():
-                        
-            return px.scatter(
-                data_frame=filtered_df,
-                x="bill_length_mm",
-                y="bill_depth_mm",
-                color="island",
-                symbol="species",
-                labels={"bill_depth_mm": "Bill Depth (mm)",
-                       "bill_length_mm": "Bill Length (mm)",
-                       "species": "Species of Penguin",
-                       "island": "Island of origin"},
-            )
+            return SCATTER_FIG
+
+        @reactive.effect
+        def update_plotly_scatterplot():
+            # With no species selected, hide every trace and show the note instead of filtering anything
+            if not input.selected_species_list():
+                with SCATTER_FIG.batch_update():
+                    SCATTER_FIG.layout.annotations = [NO_SPECIES_NOTE]
+                    for trace in SCATTER_FIG.data:
+                        trace.visible = False
+                return
+
+            # Show only the traces with rows left after filtering, and give them the filtered points
+            data = filtered_data()
+            with SCATTER_FIG.batch_update():
+                SCATTER_FIG.layout.annotations = []
+                for (isl, sp), trace in zip(SCATTER_KEYS, SCATTER_FIG.data):
+                    rows = (data.island == isl) & (data.species == sp)
+                    # Use a local here: inside batch_update, reading trace.visible back gives the old value
+                    show = bool(rows.any())
+                    trace.visible = show
+                    if show:
+                        trace.x = data.bill_length_mm[rows]
+                        trace.y = data.bill_depth_mm[rows]
     
     # --------------------------------------------------------
     # Reactive calculations and effects
@@ -196,7 +391,9 @@ with ui.layout_columns():
 
         @render.plot(alt="A Seaborn histogram on penguin body mass in grams.")
         def seaborn_histogram():
-                    histplot = sns.histplot(data=filtered_df, x="body_mass_g", bins=input.seaborn_bin_count() )
+                    counts, edges = bin_counts(filtered_data().body_mass_g, input.seaborn_bin_count())
+                    histplot = reset_axes(_AX_RCALC)
+                    draw_hist(histplot, counts, edges)
                     histplot.set_title("Palmer Penguins")
                     histplot.set_xlabel("Mass (g)")
                     histplot.set_ylabel("Count")
@@ -0,0 +1,48 @@
+# Histogram binning helpers for app.py
+# These live in their own module so they're imported once per process instead of re-run with
+# every Shiny Express session, and so numba's cache=True has a real source file to cache against.
+
+import numpy as np
+
+# Numba compiles the histogram binning loop when it's installed
+# Shinylive (Pyodide) has no numba, so there the same function runs as a NumPy fallback
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Count values of x into nb equal-width bins between lo and hi in a single pass
+# NaN and out-of-range values are skipped, and hi itself lands in the last bin
+if njit is not None:
+    @njit(cache=True)
+    def _hist(x, lo, hi, nb):
+        out = np.zeros(nb, np.int64)
+        inv = nb / (hi - lo)
+        for v in x:
+            if lo <= v <= hi:
+                out[min(int((v - lo) * inv), nb - 1)] += 1
+        return out
+else:
+    def _hist(x, lo, hi, nb):
+        x = x[(x >= lo) & (x <= hi)]
+        idx = np.minimum(((x - lo) * (nb / (hi - lo))).astype(np.int64), nb - 1)
+        return np.bincount(idx, minlength=nb)
+
+# Call _hist once with the float32 arrays the app uses, so numba compiles (or loads its on-disk cache)
+# when this module is imported instead of during the first histogram update
+_hist(np.zeros(1, np.float32), 0.0, 1.0, 2)
+
+
+def bin_counts(arr: np.ndarray, nb: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return (counts, edges) for nb equal-width bins spanning the non-NaN values of arr."""
+    # _hist indexes out[nb - 1] without bounds checks, so nb has to be at least 1
+    if nb < 1:
+        raise ValueError(f"nb must be at least 1, got {nb}")
+    arr = arr[~np.isnan(arr)]
+    if arr.size == 0:
+        return np.zeros(nb, np.int64), np.linspace(0.0, 1.0, nb + 1)
+    lo, hi = float(arr.min()), float(arr.max())
+    if lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    return _hist(arr, lo, hi, nb), np.linspace(lo, hi, nb + 1)